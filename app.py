@@ -1,47 +1,102 @@
-from flask import Flask, request, send_file, render_template_string
+from flask import Flask, request, send_file
+import codecs
+import functools
+import hashlib
 import io
+import os
 import re
+import sys
+import threading
+from collections import OrderedDict
 import csv as csv_module
 from pathlib import Path
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.units import cm
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.utils import ImageReader
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Image, Paragraph
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
-from PIL import Image as PILImage
 
 app = Flask(__name__)
-
-# === Register Arial Font (same logic as bill.py) ===
-try:
-    arial_paths = [
+# Reject oversized uploads before they are spooled to disk
+app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024
+
+# === Register Arial Font ===
+# Only the current platform's font locations are probed. "~" is expanded when
+# the fonts are registered, so a missing home directory only drops those paths.
+ARIAL_PATHS_BY_PLATFORM = {
+    "darwin": [
         "/Library/Fonts/Arial.ttf",
         "/System/Library/Fonts/Arial.ttf",
-        Path.home() / "Library/Fonts/Arial.ttf",
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-        "C:\\Windows\\Fonts\\arial.ttf",
-    ]
-
-    arial_registered = False
-    for path in arial_paths:
-        path = Path(path)
+        "~/Library/Fonts/Arial.ttf",
+    ],
+    "linux": ["/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf"],
+    "win32": ["C:\\Windows\\Fonts\\arial.ttf"],
+}
+
+ARIAL_BOLD_PATHS_BY_PLATFORM = {
+    "darwin": [
+        "/Library/Fonts/Arial Bold.ttf",
+        "/System/Library/Fonts/Supplemental/Arial Bold.ttf",
+        "~/Library/Fonts/Arial Bold.ttf",
+    ],
+    "linux": ["/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"],
+    "win32": ["C:\\Windows\\Fonts\\arialbd.ttf"],
+}
+
+
+def _platform_paths(paths_by_platform):
+    paths = paths_by_platform.get(sys.platform)
+    if paths is None:
+        # Unknown platform: probe every known location
+        paths = [path for platform_paths in paths_by_platform.values() for path in platform_paths]
+    return paths
+
+
+ARIAL_PATHS = _platform_paths(ARIAL_PATHS_BY_PLATFORM)
+ARIAL_BOLD_PATHS = _platform_paths(ARIAL_BOLD_PATHS_BY_PLATFORM)
+
+
+def _register_font(name, paths):
+    """Register a font from the first usable path; return whether it worked."""
+    if name in pdfmetrics.getRegisteredFontNames():
+        return True
+    for path in paths:
+        try:
+            path = Path(path).expanduser()
+        except RuntimeError:
+            # No home directory to resolve "~" against; skip this candidate
+            continue
         if path.exists():
             try:
-                pdfmetrics.registerFont(TTFont("Arial", str(path)))
-                arial_registered = True
-                break
+                pdfmetrics.registerFont(TTFont(name, str(path)))
+                return True
             except Exception:
                 continue
+    return False
 
-    if not arial_registered:
-        arial_font = "Helvetica"
-    else:
-        arial_font = "Arial"
 
-except Exception:
-    arial_font = "Helvetica"
+@functools.lru_cache(maxsize=1)
+def _register_arial():
+    """Register Arial and Arial-Bold once; return (regular, bold) font names."""
+    try:
+        regular = _register_font("Arial", ARIAL_PATHS)
+        bold = regular and _register_font("Arial-Bold", ARIAL_BOLD_PATHS)
+    except Exception:
+        return "Helvetica", "Helvetica-Bold"
+    if not regular:
+        return "Helvetica", "Helvetica-Bold"
+    if not bold:
+        return "Arial", "Helvetica-Bold"
+    return "Arial", "Arial-Bold"
+
+
+arial_font, ARIAL_BOLD = _register_arial()
+
+# Sample stylesheet is the same for every request; build it once.
+STYLES = getSampleStyleSheet()
 
 
 def get_font_size_pt(area_cm2):
@@ -58,16 +113,92 @@ def get_font_size_pt(area_cm2):
     return 24
 
 
+PAGE_WIDTH_POINTS, PAGE_HEIGHT_POINTS = A4
+A4_PAGE_WIDTH_CM = PAGE_WIDTH_POINTS / cm
+
+# Spacer above the barcode, applied as the top padding of its table row
+BARCODE_TOP_SPACER_HEIGHT = 0.2 * cm
+BARCODE_BOTTOM_PADDING_HEIGHT = 3 * (cm / 72.0)
+BARCODE_ROW_PADDING = BARCODE_TOP_SPACER_HEIGHT + BARCODE_BOTTOM_PADDING_HEIGHT
+MIN_BARCODE_IMAGE_HEIGHT = 0.5 * cm
+
+
+def _table_style_commands(font_size_pt, with_barcode):
+    commands = [
+        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("FONTNAME", (0, 0), (-1, -1), arial_font),
+        ("FONTSIZE", (0, 0), (-1, -1), font_size_pt),
+        ("LEFTPADDING", (0, 0), (-1, -1), 3),
+        ("RIGHTPADDING", (0, 0), (-1, -1), 3),
+        ("TOPPADDING", (0, 0), (-1, -1), 3),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
+    ]
+    if not with_barcode:
+        commands.append(("GRID", (0, 0), (-1, -1), 1, colors.black))
+        return commands
+
+    # The barcode is the last row, spanned across both columns and boxed
+    # on its own; the grid stops just above it.
+    commands.extend(
+        [
+            ("SPAN", (0, -1), (1, -1)),
+            ("BOX", (0, -1), (1, -1), 1, colors.black),
+            ("ALIGN", (0, -1), (1, -1), "CENTER"),
+            ("VALIGN", (0, -1), (1, -1), "MIDDLE"),
+            ("TOPPADDING", (0, -1), (1, -1), BARCODE_TOP_SPACER_HEIGHT),
+            ("BOTTOMPADDING", (0, -1), (1, -1), 3),
+            ("GRID", (0, 0), (-1, -2), 1, colors.black),
+        ]
+    )
+    return commands
+
+
+@functools.lru_cache(maxsize=32)
+def get_table_layout(font_size_pt, total_table_width_cm):
+    """Return (paragraph style, table style, table style with barcode, column widths).
+
+    These only depend on the font size and table width, so bills with the same
+    label shape share them instead of rebuilding them on every request.
+    """
+    style = ParagraphStyle(
+        "CustomText",
+        parent=STYLES["Normal"],
+        fontSize=font_size_pt,
+        fontName=arial_font,
+        leading=font_size_pt * 1.1,
+        wordWrap="CJK",
+        spaceAfter=0,
+        spaceBefore=0,
+    )
+    table_style = TableStyle(_table_style_commands(font_size_pt, with_barcode=False))
+    barcode_table_style = TableStyle(_table_style_commands(font_size_pt, with_barcode=True))
+    col_widths = (
+        total_table_width_cm / 3.0 * cm,
+        total_table_width_cm * (2.0 / 3.0) * cm,
+    )
+    return style, table_style, barcode_table_style, col_widths
+
+
+# Control characters, general punctuation (U+2000-U+206F) and stray bullet
+# glyphs are deleted from cell text with a single str.translate.
+_CTRL_TABLE = dict.fromkeys(range(0x00, 0x20))
+_CTRL_TABLE.update(dict.fromkeys(range(0x7F, 0xA0)))
+_CTRL_TABLE.update(dict.fromkeys(range(0x2000, 0x2070)))
+_CTRL_TABLE.update(dict.fromkeys(map(ord, "■□●◾◻▪▫")))
+_WS_RE = re.compile(r"\s+")
+
+
 def clean_text(text):
     text = str(text).strip()
-    text = re.sub(r"[\x00-\x1F\x7F-\x9F\u2000-\u206F■□●◾◻▪▫\u25A1]", "", text)
-    text = re.sub(r"\s+", " ", text)
-    return text
+    # Printable ASCII without double spaces has nothing to remove or collapse
+    if text.isascii() and text.isprintable() and "  " not in text:
+        return text
+    return _WS_RE.sub(" ", text.translate(_CTRL_TABLE))
 
 
-@app.route("/", methods=["GET"])
-def index():
-    html = """<!DOCTYPE html>
+# Static upload form; it has no template variables so it is served as-is.
+_INDEX_HTML = """<!DOCTYPE html>
 <html lang=\"en\">
 <head>
     <meta charset=\"UTF-8\" />
@@ -125,7 +256,68 @@ def index():
     </div>
 </body>
 </html>"""
-    return render_template_string(html)
+
+
+# Decoded barcode images, keyed by a digest of the uploaded bytes. The cache is
+# bounded by the memory the decoded images pin, not by how many there are.
+IMAGE_READER_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Larger images are decoded per request and never kept
+IMAGE_READER_MAX_CACHED_BYTES = 4 * 1024 * 1024
+_image_readers = OrderedDict()  # digest -> (reader, decoded size in bytes)
+_image_readers_bytes = 0
+_image_readers_lock = threading.Lock()
+
+
+def get_image_reader(data):
+    """Return an ImageReader for image bytes, reusing decoded images across requests.
+
+    JPEGs are embedded into the PDF without decoding, so there is nothing to
+    reuse; their reader also seeks its stream while drawing, so each request
+    gets its own.
+    """
+    global _image_readers_bytes
+
+    if data[:2] == b"\xff\xd8":
+        return ImageReader(io.BytesIO(data))
+
+    key = hashlib.blake2b(data, digest_size=16).digest()
+    with _image_readers_lock:
+        entry = _image_readers.get(key)
+        if entry is not None:
+            _image_readers.move_to_end(key)
+            return entry[0]
+
+    reader = ImageReader(io.BytesIO(data))
+    # The reader keeps both the decoded RGB pixels and the PIL image, so count
+    # them twice; the size comes from the header, before anything is decoded
+    width, height = reader.getSize()
+    size = 2 * 3 * width * height
+    if size > IMAGE_READER_MAX_CACHED_BYTES:
+        return reader
+    # Decode up front so a shared reader is only ever read from
+    reader.getRGBData()
+    with _image_readers_lock:
+        if key not in _image_readers:
+            _image_readers[key] = (reader, size)
+            _image_readers_bytes += size
+        while _image_readers_bytes > IMAGE_READER_CACHE_MAX_BYTES:
+            _, (_, evicted_size) = _image_readers.popitem(last=False)
+            _image_readers_bytes -= evicted_size
+    return reader
+
+
+class ReaderImage(Image):
+    """Image flowable drawn from an already parsed ImageReader."""
+
+    def __init__(self, reader, width=None, height=None):
+        # With _img already set, Image never re-reads the stream it is given
+        self._img = reader
+        Image.__init__(self, reader.fp, width=width, height=height)
+
+
+@app.route("/", methods=["GET"])
+def index():
+    return _INDEX_HTML, 200, {"Content-Type": "text/html; charset=utf-8"}
 
 
 @app.route("/generate", methods=["POST"])
@@ -157,44 +349,48 @@ def generate():
     # Read CSV from uploaded file
     data = {}
     try:
-        csv_bytes = csv_file.read()
-        text_stream = io.StringIO(csv_bytes.decode("utf-8-sig"))
-        reader = csv_module.reader(text_stream)
-        for row in reader:
-            if not row:
-                continue
-            if len(row) > 1:
-                key = row[0]
-                value = ",".join(row[1:])
-                data[key.strip()] = value.strip()
-            elif len(row) == 1:
-                data[row[0].strip()] = ""
+        # Decode line by line straight off the uploaded stream instead of
+        # copying it into memory; works whatever file type Werkzeug spooled to
+        reader = csv_module.reader(codecs.iterdecode(csv_file.stream, "utf-8-sig"))
+        # First column is the key; any further columns are the value, re-joined
+        data = dict((row[0].strip(), ",".join(row[1:]).strip()) for row in reader if row)
     except Exception as e:
         return f"Error reading CSV: {e}", 400
 
-    # Prepare styles
-    styles = getSampleStyleSheet()
-    style = ParagraphStyle(
-        "CustomText",
-        parent=styles["Normal"],
-        fontSize=font_size_pt,
-        fontName=arial_font,
-        leading=font_size_pt * 1.1,
-        wordWrap="CJK",
-        spaceAfter=0,
-        spaceBefore=0,
+    # Width logic
+    if smallest_side > A4_PAGE_WIDTH_CM:
+        total_table_width_cm = 20.0
+    else:
+        total_table_width_cm = smallest_side - 1.0
+    if total_table_width_cm <= 0:
+        total_table_width_cm = 1.0
+    total_table_width = total_table_width_cm * cm
+
+    style, table_style, barcode_table_style, col_widths = get_table_layout(
+        font_size_pt, total_table_width_cm
     )
 
-    table_data = []
-    for col_name, val in data.items():
-        col_name = clean_text(col_name)
-        val = clean_text(val)
-        col_para = Paragraph(col_name, style)
-        val_para = Paragraph(val, style)
-        table_data.append([col_para, val_para])
+    # Repeated cell values (units, "N/A", ...) share one Paragraph per column,
+    # so each distinct text is parsed only once.
+    paragraphs = {}
+
+    def make_para(text, column):
+        key = (text, column)
+        para = paragraphs.get(key)
+        if para is None:
+            para = paragraphs[key] = Paragraph(text, style)
+        return para
+
+    # Clean all keys and values in one pass each, then pair them into rows
+    col_names = map(clean_text, data.keys())
+    vals = map(clean_text, data.values())
+    table_data = [
+        [make_para(col_name, 0), make_para(val, 1)]
+        for col_name, val in zip(col_names, vals)
+    ]
 
     # header helper
-    g = {"width_cm": 0.0, "height_points": 0.0}
+    g = {"width_cm": total_table_width_cm, "height_points": 0.0}
 
     def add_page_header(canvas, doc):
         canvas.saveState()
@@ -203,11 +399,9 @@ def generate():
         width_in = width_cm / 2.54
         height_in = (height_points / cm) / 2.54
         dim_str = f"W: {width_in:.2f} in  |  H: {height_in:.2f} in"
-        page_width, page_height = A4
-        bold_font = arial_font + "-Bold" if "Arial" in arial_font else "Helvetica-Bold"
-        canvas.setFont(bold_font, font_size_pt)
+        canvas.setFont(ARIAL_BOLD, font_size_pt)
         canvas.setFillColor(colors.black)
-        canvas.drawRightString(page_width - 1 * cm, page_height - 1 * cm, dim_str)
+        canvas.drawRightString(PAGE_WIDTH_POINTS - 1 * cm, PAGE_HEIGHT_POINTS - 1 * cm, dim_str)
         canvas.restoreState()
 
     # Create PDF in memory
@@ -223,47 +417,13 @@ def generate():
     )
 
     story = []
-    page_width_points, page_height_points = A4
-
-    # Width logic
-    a4_page_width_cm = A4[0] / cm
-    if smallest_side > a4_page_width_cm:
-        total_table_width_cm = 20.0
-    else:
-        total_table_width_cm = smallest_side - 1.0
-    if total_table_width_cm <= 0:
-        total_table_width_cm = 1.0
-
-    g["width_cm"] = total_table_width_cm
-
-    col_width_cm = total_table_width_cm / 3.0
-    col_value_width_cm = total_table_width_cm * (2.0 / 3.0)
-
-    col_width = col_width_cm * cm
-    col_value_width = col_value_width_cm * cm
-    total_table_width = total_table_width_cm * cm
 
-    # Temporary table (without barcode) to get height
-    temp_table = Table(table_data, colWidths=[col_width, col_value_width])
-    temp_table.setStyle(
-        TableStyle(
-            [
-                ("FONTNAME", (0, 0), (-1, -1), arial_font),
-                ("FONTSIZE", (0, 0), (-1, -1), font_size_pt),
-                ("LEFTPADDING", (0, 0), (-1, -1), 3),
-                ("RIGHTPADDING", (0, 0), (-1, -1), 3),
-                ("TOPPADDING", (0, 0), (-1, -1), 3),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-            ]
-        )
-    )
-    _, main_table_height_points = temp_table.wrap(total_table_width, page_height_points)
+    # Table without barcode; this is the final table when no barcode is added
+    data_table = Table(table_data, colWidths=col_widths)
+    data_table.setStyle(table_style)
+    _, main_table_height_points = data_table.wrap(total_table_width, PAGE_HEIGHT_POINTS)
 
     max_allowed_height_points = second_smallest_side * cm
-    TOP_SPACER_HEIGHT = 0.2 * cm
-    BOTTOM_PADDING_HEIGHT = 3 * (cm / 72.0)
-    TOTAL_ROW_PADDING = TOP_SPACER_HEIGHT + BOTTOM_PADDING_HEIGHT
-    MIN_BARCODE_IMAGE_HEIGHT = 0.5 * cm
 
     target_barcode_height = 0
 
@@ -273,7 +433,7 @@ def generate():
     else:
         barcode_height_1_7th = main_table_height_points / 7.0
         total_height_with_1_7th = (
-            main_table_height_points + barcode_height_1_7th + TOTAL_ROW_PADDING
+            main_table_height_points + barcode_height_1_7th + BARCODE_ROW_PADDING
         )
         if total_height_with_1_7th <= max_allowed_height_points:
             target_barcode_height = barcode_height_1_7th
@@ -281,7 +441,7 @@ def generate():
             remaining_space_for_image = (
                 max_allowed_height_points
                 - main_table_height_points
-                - TOTAL_ROW_PADDING
+                - BARCODE_ROW_PADDING
             )
             if remaining_space_for_image < MIN_BARCODE_IMAGE_HEIGHT:
                 target_barcode_height = MIN_BARCODE_IMAGE_HEIGHT
@@ -293,9 +453,9 @@ def generate():
     if barcode_file and barcode_file.filename:
         try:
             barcode_bytes = barcode_file.read()
-            image_stream_for_pil = io.BytesIO(barcode_bytes)
-            pil_img = PILImage.open(image_stream_for_pil)
-            img_width_px, img_height_px = pil_img.size
+            # A cached reader already knows its size, so nothing is parsed again
+            barcode_reader = get_image_reader(barcode_bytes)
+            img_width_px, img_height_px = barcode_reader.getSize()
             if img_height_px > 0:
                 aspect_ratio = img_width_px / img_height_px
                 final_barcode_height = target_barcode_height
@@ -305,46 +465,34 @@ def generate():
                     final_barcode_width = max_width * 0.98
                     final_barcode_height = final_barcode_width / aspect_ratio
 
-                image_stream_for_rl = io.BytesIO(barcode_bytes)
-                img = Image(image_stream_for_rl, width=final_barcode_width, height=final_barcode_height)
+                img = ReaderImage(
+                    barcode_reader,
+                    width=final_barcode_width,
+                    height=final_barcode_height,
+                )
                 table_data.append([img, ""])  # new row for barcode
                 barcode_exists = True
         except Exception:
             barcode_exists = False
 
-    # Base style commands
-    style_commands = [
-        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-        ("FONTNAME", (0, 0), (-1, -1), arial_font),
-        ("FONTSIZE", (0, 0), (-1, -1), font_size_pt),
-        ("LEFTPADDING", (0, 0), (-1, -1), 3),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 3),
-        ("TOPPADDING", (0, 0), (-1, -1), 3),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-    ]
-
-    grid_end_row = -1
     if barcode_exists:
-        grid_end_row = -2
-        style_commands.extend(
-            [
-                ("SPAN", (0, -1), (1, -1)),
-                ("BOX", (0, -1), (1, -1), 1, colors.black),
-                ("ALIGN", (0, -1), (1, -1), "CENTER"),
-                ("VALIGN", (0, -1), (1, -1), "MIDDLE"),
-                ("TOPPADDING", (0, -1), (1, -1), TOP_SPACER_HEIGHT),
-                ("BOTTOMPADDING", (0, -1), (1, -1), 3),
-            ]
-        )
-
-    style_commands.append(("GRID", (0, 0), (-1, grid_end_row), 1, colors.black))
-
-    table = Table(table_data, colWidths=[col_width, col_value_width])
-    table.setStyle(TableStyle(style_commands))
+        # Rows are sized independently, so measuring the barcode row on its own
+        # avoids laying out every data Paragraph a second time.
+        barcode_row = Table(table_data[-1:], colWidths=col_widths)
+        barcode_row.setStyle(barcode_table_style)
+        _, barcode_row_height_points = barcode_row.wrap(total_table_width, PAGE_HEIGHT_POINTS)
+
+        table = Table(table_data, colWidths=col_widths)
+        table.setStyle(barcode_table_style)
+    else:
+        barcode_row_height_points = 0
+        table = data_table
 
-    _, main_table_height_points = table.wrap(total_table_width, page_height_points * 10)
-    g["height_points"] = main_table_height_points
+    # Wrapping against a single page stops early once the table overflows it,
+    # so only then measure again with room for the whole table.
+    if main_table_height_points > PAGE_HEIGHT_POINTS:
+        _, main_table_height_points = data_table.wrap(total_table_width, PAGE_HEIGHT_POINTS * 10)
+    g["height_points"] = main_table_height_points + barcode_row_height_points
 
     story.append(table)
 
@@ -356,8 +504,15 @@ def generate():
         mimetype="application/pdf",
         as_attachment=True,
         download_name="bill.pdf",
+        max_age=0,
     )
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, debug=True)
+    # Development server only; in production run under gunicorn (see gunicorn.conf.py)
+    app.run(
+        host="0.0.0.0",
+        port=8000,
+        debug=os.environ.get("FLASK_DEBUG") == "1",
+        threaded=True,
+    )
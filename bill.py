@@ -1,4 +1,6 @@
 import re
+import io
+import struct
 import csv
 from pathlib import Path
 from reportlab.lib.pagesizes import A4
@@ -46,6 +48,67 @@ except Exception as e:
     print("  Falling back to Helvetica")
     arial_font = "Helvetica"
 
+# === Register Arial Bold Font (used by the page header) ===
+if arial_font == "Arial":
+    try:
+        arial_bold_paths = [
+            "/Library/Fonts/Arial Bold.ttf",
+            "/System/Library/Fonts/Supplemental/Arial Bold.ttf",
+            Path.home() / "Library/Fonts/Arial Bold.ttf",
+            "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",  # Linux fallback
+            "C:\\Windows\\Fonts\\arialbd.ttf",  # Windows
+        ]
+
+        for path in arial_bold_paths:
+            path = Path(path)
+            if path.exists():
+                try:
+                    pdfmetrics.registerFont(TTFont("Arial-Bold", str(path)))
+                    print(f"✓ Arial Bold font registered from: {path}")
+                    break
+                except Exception as font_err:
+                    print(f"  Could not register from {path}: {font_err}")
+                    continue
+    except Exception as e:
+        print(f"⚠ Error during bold font registration: {e}")
+        print("  Falling back to Helvetica-Bold")
+
+# Resolved once; an unregistered "Arial-Bold" would otherwise fail on every page
+ARIAL_BOLD = "Arial-Bold" if "Arial-Bold" in pdfmetrics.getRegisteredFontNames() else "Helvetica-Bold"
+
+# === Image size from header ===
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# JPEG start-of-frame markers (C4, C8 and CC are not frames)
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def get_image_size(data):
+    """Return (width, height) in pixels of an image from its header bytes.
+
+    PNG and JPEG are read directly from the header; anything else falls back
+    to PIL, which still only parses the header.
+    """
+    if data[:8] == _PNG_SIGNATURE and data[12:16] == b'IHDR':
+        return struct.unpack('>II', data[16:24])
+    if data[:2] == b'\xff\xd8':
+        i = 2
+        while i + 9 <= len(data):
+            if data[i] != 0xFF:
+                break
+            marker = data[i + 1]
+            if marker == 0xFF:
+                i += 1
+                continue
+            if marker in _JPEG_SOF_MARKERS:
+                height, width = struct.unpack('>HH', data[i + 5:i + 9])
+                return width, height
+            if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+                i += 2
+                continue
+            (segment_length,) = struct.unpack('>H', data[i + 2:i + 4])
+            i += 2 + segment_length
+    with PILImage.open(io.BytesIO(data)) as pil_img:
+        return pil_img.size
+
 # === Input files ===
 csv_path = Path("product_data.csv")
 full_barcode_image_path = Path("barcode.png")
@@ -96,15 +159,8 @@ data = {}
 try:
     with open(csv_path, 'r', encoding='utf-8-sig') as f:
         reader = csv.reader(f)
-        for row in reader:
-            if not row:
-                continue
-            if len(row) > 1:
-                key = row[0]
-                value = ','.join(row[1:])
-                data[key.strip()] = value.strip()
-            elif len(row) == 1:
-                data[row[0].strip()] = ""
+        # First column is the key; any further columns are the value, re-joined
+        data = dict((row[0].strip(), ','.join(row[1:]).strip()) for row in reader if row)
                 
 except FileNotFoundError:
     print(f"Error: CSV file not found at {csv_path}")
@@ -114,11 +170,20 @@ except Exception as e:
     data = {}
 
 # === 4. Clean data and setup styles ===
+# Control characters, general punctuation (U+2000-U+206F) and stray bullet
+# glyphs are deleted from cell text with a single str.translate.
+_CTRL_TABLE = dict.fromkeys(range(0x00, 0x20))
+_CTRL_TABLE.update(dict.fromkeys(range(0x7F, 0xA0)))
+_CTRL_TABLE.update(dict.fromkeys(range(0x2000, 0x2070)))
+_CTRL_TABLE.update(dict.fromkeys(map(ord, '■□●◾◻▪▫')))
+_WS_RE = re.compile(r'\s+')
+
 def clean_text(text):
     text = str(text).strip()
-    text = re.sub(r'[\x00-\x1F\x7F-\x9F\u2000-\u206F■□●◾◻▪▫\u25A1]', '', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text
+    # Printable ASCII without double spaces has nothing to remove or collapse
+    if text.isascii() and text.isprintable() and '  ' not in text:
+        return text
+    return _WS_RE.sub(' ', text.translate(_CTRL_TABLE))
 
 styles = getSampleStyleSheet()
 style = ParagraphStyle(
@@ -133,13 +198,13 @@ style = ParagraphStyle(
 )
 
 # === 5. Build Table Data ===
-table_data = []
-for col_name, val in data.items():
-    col_name = clean_text(col_name)
-    val = clean_text(val)
-    col_para = Paragraph(col_name, style)
-    val_para = Paragraph(val, style)
-    table_data.append([col_para, val_para])
+# Clean all keys and values in one pass each, then pair them into rows
+col_names = map(clean_text, data.keys())
+vals = map(clean_text, data.values())
+table_data = [
+    [Paragraph(col_name, style), Paragraph(val, style)]
+    for col_name, val in zip(col_names, vals)
+]
 
 # --- Global dictionary for header ---
 g = {"width_cm": 0.0, "height_points": 0.0}
@@ -162,8 +227,7 @@ def add_page_header(canvas, doc):
     
     page_width, page_height = A4
     
-    bold_font = arial_font + "-Bold" if "Arial" in arial_font else "Helvetica-Bold"
-    canvas.setFont(bold_font, font_size_pt)
+    canvas.setFont(ARIAL_BOLD, font_size_pt)
     canvas.setFillColor(colors.black)
     
     canvas.drawRightString(
@@ -274,8 +338,7 @@ else:
 barcode_exists = False
 if full_barcode_image_path.exists():
     try:
-        pil_img = PILImage.open(full_barcode_image_path)
-        img_width_px, img_height_px = pil_img.size
+        img_width_px, img_height_px = get_image_size(full_barcode_image_path.read_bytes())
         if img_height_px == 0:
             raise Exception("Invalid barcode image height (0px)")
         
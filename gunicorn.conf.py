@@ -0,0 +1,11 @@
+# Production server settings, picked up by `gunicorn app:app`.
+import multiprocessing
+
+bind = "0.0.0.0:8000"
+
+# Load the app (and register fonts) once in the master; workers share it
+preload_app = True
+
+workers = multiprocessing.cpu_count() + 1
+worker_class = "gthread"
+threads = 4